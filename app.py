@@ -1,15 +1,80 @@
 from flask import Flask, render_template, request, jsonify
+from flask.json.provider import JSONProvider
 from elasticsearch import Elasticsearch, helpers
+from elasticsearch.exceptions import NotFoundError, SerializationError
+from elasticsearch.serializer import JSONSerializer
+import orjson
+from blake3 import blake3
 import os
 import hashlib
+import mmap
 from tqdm import tqdm
 import time
 import sys
 import json
 import threading
+import queue
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from logging.handlers import RotatingFileHandler
 from flask import g
 
+class OrjsonProvider(JSONProvider):
+    """Serialize request and response JSON with orjson instead of the stdlib"""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+class OrjsonSerializer(JSONSerializer):
+    """Serialize Elasticsearch requests, including bulk bodies, and parse responses with orjson"""
+    def dumps(self, data):
+        # Pre-serialized bodies pass through untouched, as in JSONSerializer
+        if isinstance(data, str):
+            return data
+        try:
+            return orjson.dumps(data, default=self.default).decode()
+        except TypeError:
+            # orjson rejects lone surrogates, which os.fsdecode gives non-UTF-8 file
+            # names; the stdlib escapes them, and raises SerializationError itself
+            return super().dumps(data)
+
+    def loads(self, s):
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError as e:
+            raise SerializationError(s, e)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Per-file indexing messages go to a rotating log file rather than stdout,
+# where they would contend with the progress bar
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+def _configure_log():
+    """Attach the indexing log file on first use, so importing the module creates no files"""
+    if not log.handlers:
+        # Paths that are not valid UTF-8 are logged with the undecodable bytes escaped
+        handler = RotatingFileHandler('indexing.log', maxBytes=10 * 1024 * 1024, backupCount=3,
+                                      encoding='utf-8', errors='backslashreplace')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+        log.addHandler(handler)
+
+# Files above this size are also announced on the console while indexing
+LARGE_FILE_SIZE = 50 * 1024 * 1024
+
+# Files up to this size are read into memory in one go rather than memory-mapped.
+# Each file worker may hold one such buffer at a time.
+READ_ALL_THRESHOLD = 16 * 1024 * 1024
+
+# Files finished by earlier runs, so an interrupted indexing run can resume
+PROGRESS_FILE = 'indexing_progress.jsonl'
+LEGACY_PROGRESS_FILE = 'indexing_progress.json'
 
 class IndexingStatus:
     def __init__(self):
@@ -60,86 +125,236 @@ def start_indexing(engine, data_dir):
 
 @app.route('/indexing-status')
 def get_indexing_status():
+    # Snapshot under the lock so the counters agree with each other, format outside it
+    with indexing_status.progress_lock:
+        is_indexing = indexing_status.is_indexing
+        files_indexed = indexing_status.files_indexed
+        total_files = indexing_status.total_files
+        current_file = indexing_status.current_file
+        current_size = indexing_status.current_size
+        total_size = indexing_status.total_size
+        elapsed_time = indexing_status.get_elapsed_time()
+
     return jsonify({
-        'is_indexing': indexing_status.is_indexing,
-        'files_indexed': indexing_status.files_indexed,
-        'total_files': indexing_status.total_files,
-        'current_file': indexing_status.current_file,
-        'processed_size': indexing_status.format_size(indexing_status.current_size),
-        'total_size': indexing_status.format_size(indexing_status.total_size),
-        'elapsed_time': indexing_status.get_elapsed_time(),
-        'percent_complete': round((indexing_status.current_size / indexing_status.total_size * 100) if indexing_status.total_size > 0 else 0, 2)
+        'is_indexing': is_indexing,
+        'files_indexed': files_indexed,
+        'total_files': total_files,
+        'current_file': current_file,
+        'processed_size': indexing_status.format_size(current_size),
+        'total_size': indexing_status.format_size(total_size),
+        'elapsed_time': elapsed_time,
+        'percent_complete': round((current_size / total_size * 100) if total_size > 0 else 0, 2)
     })
 
+# Extensions that never hold searchable text, skipped without opening the file
+_BINARY_EXTENSIONS = (
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.tar',
+    '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.ico',
+    '.pdf', '.exe', '.dll', '.so', '.bin', '.iso', '.img',
+    '.mp3', '.mp4', '.avi', '.mkv', '.mov'
+)
+
+# Control bytes that do not turn up in text; tab, newlines and form feed are
+# left out, as are bytes >= 0x80 so UTF-8 and Latin-1 dumps still count as text
+_CONTROL_BYTES = bytes(range(0x09)) + bytes(range(0x0e, 0x20)) + b'\x7f'
+
+def _looks_binary(head):
+    """Guess from the first bytes of a file whether it is binary"""
+    # Text in any single-byte or UTF-8 encoding never contains NUL
+    if b'\x00' in head:
+        return True
+    # Otherwise call it binary when more than 30% of the sample is control bytes
+    return len(head) - len(head.translate(None, _CONTROL_BYTES)) > 0.3 * len(head)
+
+def _fingerprint_file(filepath):
+    """Return the BLAKE3 fingerprint of a file, or None if it looks binary"""
+    with open(filepath, 'rb') as f:
+        if hasattr(os, 'posix_fadvise'):
+            # The whole file is read front to back; let the kernel read ahead aggressively
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        head = f.read(8192)
+        if _looks_binary(head):
+            return None
+        
+        # Hash the rest of the file through one reused buffer, carrying on from the
+        # sniffed prefix so each byte is read exactly once. The hash is only used
+        # for deduplication, so SIMD-accelerated BLAKE3 is used over MD5 for speed.
+        hasher = blake3(head)
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(f, lambda: hasher).hexdigest(length=16)
+        
+        # Python < 3.11: same readinto loop as hashlib.file_digest
+        buf = bytearray(1 << 20)
+        view = memoryview(buf)
+        while size := f.readinto(buf):
+            hasher.update(view[:size])
+        return hasher.hexdigest(length=16)
+
+@contextmanager
+def _file_content(filepath, file_size):
+    """Yield (file_hash, data) for a file's raw bytes, or (None, None) if it looks binary.
+    Files up to READ_ALL_THRESHOLD are read once into memory and hashed from there;
+    larger ones are fingerprinted in a streaming pass and then memory-mapped."""
+    if file_size <= READ_ALL_THRESHOLD:
+        # One allocation and one pass over the file, instead of a hashing pass plus an
+        # mmap. The head is sniffed first so binary files are not read in full.
+        data = bytearray(file_size)
+        with open(filepath, 'rb') as f, memoryview(data) as view:
+            size = f.readinto(view[:8192])
+            binary = _looks_binary(data[:size])
+            if not binary:
+                size += f.readinto(view[size:])
+        if binary:
+            yield None, None
+        else:
+            del data[size:]
+            yield blake3(data).hexdigest(length=16), data
+        return
+    
+    file_hash = _fingerprint_file(filepath)
+    if file_hash is None:
+        yield None, None
+        return
+    
+    # Chunk straight from the page cache, decoding one chunk at a time
+    with open(filepath, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            # Same access pattern as the hashing pass: read ahead, drop pages behind
+            data.madvise(mmap.MADV_SEQUENTIAL)
+        yield file_hash, data
+
+def _iter_files(root):
+    """Recursively yield os.DirEntry objects for every file under root"""
+    try:
+        entries = os.scandir(root)
+    except OSError:
+        return
+    # Close the directory handle even if the caller stops early
+    with entries:
+        for entry in entries:
+            # d_type from the directory listing answers these without a stat call
+            if entry.is_dir(follow_symlinks=False):
+                yield from _iter_files(entry.path)
+            elif entry.is_file():
+                yield entry
+
+# How long get_index_stats answers from its cache before asking the cluster again
+STATS_CACHE_TTL = 30
+
+# Shards are sized towards this many bytes each; extra shards on a small index
+# only add per-shard overhead on a single node
+SHARD_TARGET_SIZE = 30 * 1024 ** 3
+
+# Index settings and mappings, number_of_shards is filled in by create_index
+_INDEX_SETTINGS = {
+    "settings": {
+        "number_of_replicas": 1,
+        "index.codec": "best_compression",
+        "index.refresh_interval": "30s",
+        "index.mapping.total_fields.limit": 10000,
+        "index.max_result_window": 50000
+    },
+    "mappings": {
+        "properties": {
+            # No norms: length normalisation means little for fixed-size chunks.
+            # Positions are still needed for phrase queries.
+            "content": {"type": "text", "norms": False, "index_options": "positions"},
+            "filename": {"type": "keyword"},
+            "filepath": {"type": "keyword"},
+            "file_hash": {"type": "keyword"},
+            "chunk_number": {"type": "integer"},
+            "total_chunks": {"type": "integer"},
+            "file_size": {"type": "long"},
+            "indexed_date": {"type": "date"}
+        }
+    }
+}
+
 class TextSearchEngine:
-    def __init__(self, es_host='localhost', es_port=9200, index_name='text_documents'):
-        self.es = Elasticsearch(
-            [{'host': es_host, 'port': es_port}],
-            http_compress=True,
-            verify_certs=False
-        )
+    def __init__(self, es_host='localhost', es_port=9200, index_name='text_documents', es_client=None):
+        # One client serves both indexing and the web interface; pass es_client to
+        # share an existing one. Connections are kept alive in a pool of 32, twice
+        # the most bulk threads index_directory starts by default plus room for searches.
+        # The timeout leaves room for a 40MB bulk request on a busy cluster.
+        if es_client is None:
+            es_client = Elasticsearch(
+                [{'host': es_host, 'port': es_port}],
+                http_compress=True,
+                verify_certs=False,
+                serializer=OrjsonSerializer(),
+                maxsize=32,
+                timeout=120,
+                max_retries=3,
+                retry_on_timeout=True
+            )
+        self.es = es_client
         self.index_name = index_name
+        # Hashes of files already sent to the index, used to skip identical copies
+        self._seen_hashes = set()
+        # (timestamp, stats) of the last get_index_stats call
+        self._stats_cache = None
     
     def delete_index(self):
         """Delete the index if it exists"""
         if self.es.indices.exists(index=self.index_name):
             self.es.indices.delete(index=self.index_name)
             print(f"Deleted existing index: {self.index_name}")
+        self._seen_hashes.clear()
+        self._stats_cache = None
         
-    def create_index(self):
-        """Create the Elasticsearch index with appropriate mappings"""
-        settings = {
-            "settings": {
-                "number_of_shards": 5,
-                "number_of_replicas": 1,
-                "index.refresh_interval": "30s",
-                "index.mapping.total_fields.limit": 10000,
-                "index.max_result_window": 50000
-            },
-            "mappings": {
-                "properties": {
-                    "content": {"type": "text"},
-                    "filename": {"type": "keyword"},
-                    "filepath": {"type": "keyword"},
-                    "file_hash": {"type": "keyword"},
-                    "chunk_number": {"type": "integer"},
-                    "total_chunks": {"type": "integer"},
-                    "file_size": {"type": "long"},
-                    "indexed_date": {"type": "date"}
-                }
-            }
-        }
+    def create_index(self, number_of_shards=None, target_size=0):
+        """Create the Elasticsearch index with appropriate mappings.
+        Unless number_of_shards is given, one shard is used per SHARD_TARGET_SIZE of target_size bytes."""
+        if number_of_shards is None:
+            number_of_shards = max(1, target_size // SHARD_TARGET_SIZE)
+        body = dict(_INDEX_SETTINGS, settings={**_INDEX_SETTINGS["settings"], "number_of_shards": number_of_shards})
         
         try:
-            self.es.indices.create(index=self.index_name, body=settings)
-            print(f"Created index: {self.index_name}")
+            self.es.indices.create(index=self.index_name, body=body)
+            self._stats_cache = None
+            print(f"Created index: {self.index_name} ({number_of_shards} shards)")
         except Exception as e:
             print(f"Error creating index: {str(e)}")
             raise
 
-    def chunk_text(self, text, chunk_size=500000):
-        """Split text into chunks, preserving line integrity"""
-        chunks = []
-        lines = text.splitlines()
-        current_chunk = []
-        current_size = 0
+    def chunk_bounds(self, data, chunk_size=500000):
+        """Yield (start, end) byte offsets of each chunk, breaking at newlines"""
+        pos = 0
+        end = len(data)
         
-        for line in lines:
-            line_size = len(line.encode('utf-8'))
-            if current_size + line_size > chunk_size and current_chunk:
-                # Join current chunk and add to chunks
-                chunks.append('\n'.join(current_chunk))
-                current_chunk = []
-                current_size = 0
+        while pos < end:
+            if end - pos <= chunk_size:
+                split = next_pos = end
+            else:
+                # Break at the last newline that fits, or hard-split an overlong line
+                split = data.rfind(b'\n', pos, pos + chunk_size)
+                if split == -1:
+                    split = pos + chunk_size
+                    # Step back off UTF-8 continuation bytes so no character is cut in two
+                    while split > pos and data[split] & 0xC0 == 0x80:
+                        split -= 1
+                    if split == pos:
+                        # Not UTF-8 at all; any cut is as good as another
+                        split = pos + chunk_size
+                    next_pos = split
+                else:
+                    next_pos = split + 1
             
-            current_chunk.append(line)
-            current_size += line_size
-        
-        # Add the last chunk if there is one
-        if current_chunk:
-            chunks.append('\n'.join(current_chunk))
-        
-        return chunks
+            if split > pos:
+                yield pos, split
+            pos = next_pos
+
+    def chunk_text(self, data, chunk_size=500000, bounds=None):
+        """Split a bytes buffer into decoded chunks, yielding (chunk_id, text) pairs.
+        The id is a hash of the chunk's bytes, so identical chunks share an id.
+        Offsets already computed by chunk_bounds can be passed in as bounds."""
+        if bounds is None:
+            bounds = self.chunk_bounds(data, chunk_size)
+        with memoryview(data) as view:
+            for start, end in bounds:
+                chunk = view[start:end]
+                yield hashlib.blake2b(chunk, digest_size=16).hexdigest(), str(chunk, 'utf-8', 'ignore')
 
     def format_size(self, size):
         """Convert size in bytes to human readable format"""
@@ -149,500 +364,381 @@ class TextSearchEngine:
             size /= 1024
         return f"{size:.2f} TB"
 
-    def index_directory(self, directory_path, batch_size=5):
-        # Load progress file if exists
-        progress_file = 'indexing_progress.json'
-        indexed_files = set()
-        if os.path.exists(progress_file):
-            with open(progress_file, 'r') as f:
-                indexed_files = set(json.load(f))
-
-        # Calculate total files and size first
-        total_size = 0
-        total_files = 0
-        for root, _, files in os.walk(directory_path):
-            for file in files:
-                filepath = os.path.join(root, file)
-                try:
-                    total_size += os.path.getsize(filepath)
-                    total_files += 1
-                except:
-                    continue
-
-        indexing_status.total_files = total_files
-        indexing_status.total_size = total_size
-        indexing_status.start_time = time.time()
+    def _indexed_filepaths(self, files, batch_size=100):
+        """Return the paths in files whose every chunk is already in the index at the same size"""
+        found = set()
+        for i in range(0, len(files), batch_size):
+            batch = files[i:i + batch_size]
+            body = []
+            for filepath, _, file_size in batch:
+                body.append({"index": self.index_name})
+                # One hit is enough to read total_chunks; the exact hit count says how many
+                # of the chunks made it in
+                body.append({
+                    "size": 1,
+                    "_source": ["total_chunks"],
+                    "track_total_hits": True,
+                    "query": {
+                        "bool": {
+                            "filter": [
+                                {"term": {"filepath": filepath}},
+                                {"term": {"file_size": file_size}}
+                            ]
+                        }
+                    }
+                })
+            
+            # One round-trip per batch instead of one count per file
+            responses = self.es.msearch(body=body)['responses']
+            for (filepath, _, _), response in zip(batch, responses):
+                hits = response.get('hits', {})
+                if hits.get('hits') and hits['total']['value'] == hits['hits'][0]['_source']['total_chunks']:
+                    found.add(filepath)
+        return found
+
+    def index_directory(self, directory_path, thread_count=None, chunk_size=10000,
+                        max_chunk_bytes=40 * 1024 * 1024, max_retries=5):
+        _configure_log()
         
-        def generate_documents():
-            for root, _, files in os.walk(directory_path):
-                for file in files:
+        # Load progress file if exists. It is append-only, one JSON-encoded path per
+        # line; older versions rewrote a single JSON list to LEGACY_PROGRESS_FILE.
+        indexed_files = set()
+        if os.path.exists(LEGACY_PROGRESS_FILE):
+            with open(LEGACY_PROGRESS_FILE, 'r') as f:
+                indexed_files.update(json.load(f))
+        if os.path.exists(PROGRESS_FILE):
+            with open(PROGRESS_FILE, 'r') as f:
+                for line in f:
                     try:
-                        filepath = os.path.join(root, file)
-                        file_size = os.path.getsize(filepath)
-
-                        indexing_status.files_indexed += 1
-                        indexing_status.current_size += file_size
-                        indexing_status.current_file = filepath
-                        
-                        # Skip already indexed files
-                        if filepath in indexed_files:
-                            print(f"Skipping already indexed: {filepath}")
-                            continue
-                            
-                        file_size = os.path.getsize(filepath)
-                        if file_size == 0:
-                            print(f"Skipping empty file: {filepath}")
-                            continue
-                            
-                        print(f"\nProcessing: {filepath} ({self.format_size(file_size)})")
-                        
-                        # Read file in chunks to avoid memory issues
-                        chunk_content = []
-                        chunk_size = 1024 * 1024  # 1MB chunks
-                        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                            while True:
-                                chunk = f.read(chunk_size)
-                                if not chunk:
-                                    break
-                                chunk_content.append(chunk)
-                        
-                        content = ''.join(chunk_content)
-                        file_hash = hashlib.md5(content.encode()).hexdigest()
-                        chunks = self.chunk_text(content)
-                        total_chunks = len(chunks)
-                        print(f"Split into {total_chunks} chunks")
-                        
-                        for chunk_num, chunk in enumerate(chunks):
-                            yield {
-                                "_index": self.index_name,
-                                "_source": {
-                                    "content": chunk,
-                                    "filename": file,
-                                    "filepath": filepath,
-                                    "file_hash": file_hash,
-                                    "chunk_number": chunk_num,
-                                    "total_chunks": total_chunks,
-                                    "file_size": file_size,
-                                    "indexed_date": time.strftime('%Y-%m-%dT%H:%M:%S')
-                                }
-                            }
-                        
-                        # Save progress after each file
-                        indexed_files.add(filepath)
-                        with open(progress_file, 'w') as f:
-                            json.dump(list(indexed_files), f)
-                            
-                    except Exception as e:
-                        print(f"Error processing {filepath}: {str(e)}")
+                        indexed_files.add(json.loads(line))
+                    except ValueError:
+                        # Last line cut short by an interrupted run
                         continue
 
-        success, failed = 0, 0
-        doc_generator = generate_documents()
-        
-        try:
-            while True:
-                batch = []
-                try:
-                    for _ in range(batch_size):
-                        doc = next(doc_generator)
-                        batch.append(doc)
-                except StopIteration:
-                    if batch:
-                        try:
-                            bulk_response = helpers.bulk(self.es, batch, raise_on_error=False)
-                            success += bulk_response[0]
-                            failed += len(batch) - bulk_response[0]
-                        except Exception as e:
-                            print(f"\nError processing final batch: {str(e)}")
-                            failed += len(batch)
-                    break
-                
-                try:
-                    time.sleep(0.1)  # Rate limiting
-                    bulk_response = helpers.bulk(self.es, batch, raise_on_error=False)
-                    success += bulk_response[0]
-                    failed += len(batch) - bulk_response[0]
-                except Exception as e:
-                    print(f"\nError processing batch: {str(e)}")
-                    failed += len(batch)
-                    continue
-        except Exception as e:
-            print(f"\nError during indexing: {str(e)}")
-            raise
-                
-        print(f"\nIndexing complete. Success: {success}, Failed: {failed}")
-
-    def get_index_stats(self):
-        """Get statistics about the current index"""
-        try:
-            if not self.es.indices.exists(index=self.index_name):
-                return {"exists": False}
-                
-            # Get basic index statistics
-            basic_stats = self.es.indices.stats(index=self.index_name)
-            # Get document count
-            count_result = self.es.count(index=self.index_name)
-            # Get index settings and info
-            index_info = self.es.indices.get(index=self.index_name)
-            
-            # Extract size in bytes
-            size_in_bytes = basic_stats['indices'][self.index_name]['primaries']['store']['size_in_bytes']
-            
-            return {
-                "exists": True,
-                "total_documents": count_result['count'],
-                "store_size": self.format_size(size_in_bytes),
-                "number_of_shards": index_info[self.index_name]['settings']['index']['number_of_shards'],
-                "number_of_replicas": index_info[self.index_name]['settings']['index']['number_of_replicas']
-            }
-        except Exception as e:
-            print(f"Error getting stats: {str(e)}")
-            return {"exists": False, "error": str(e)}
-
-# Create template directory and files
-os.makedirs('templates', exist_ok=True)
-os.makedirs('static', exist_ok=True)
-
-# First, update the CSS file content
-with open('static/style.css', 'w') as f:
-    f.write("""
-[data-theme="dark"] {
-    /* Dark theme variables */
-    --bg-color: #1a1a1a;
-    --text-color: #e1e1e1;
-    --card-bg: #2d2d2d;
-    --card-border: #404040;
-    --highlight-bg: #363636;
-    --highlight-border: #0d6efd;
-    --code-bg: #363636;
-    --muted-text: #a0a0a0;
-    --primary-color: #0d6efd;
-    --shadow-color: rgba(0,0,0,0.2);
-}
-
-body {
-    background-color: var(--bg-color);
-    color: var(--text-color);
-    transition: background-color 0.3s ease, color 0.3s ease;
-}
-
-.search-box {
-    max-width: 800px;
-    margin: 0 auto;
-}
-
-.form-control {
-    background-color: var(--card-bg) !important;
-    color: var(--text-color) !important;
-    border-color: var(--card-border) !important;
-}
-
-.form-control:focus {
-    box-shadow: 0 0 0 0.25rem rgba(13, 110, 253, 0.25);
-}
-
-.form-select {
-    background-color: var(--card-bg) !important;
-    color: var(--text-color) !important;
-    border-color: var(--card-border) !important;
-}
-
-.result-item {
-    border: 1px solid var(--card-border);
-    border-radius: 4px;
-    margin-bottom: 1rem;
-    box-shadow: 0 2px 4px var(--shadow-color);
-    background-color: var(--card-bg);
-}
-
-.highlight {
-    margin: 0.5rem 0;
-    padding: 0.5rem;
-    background-color: var(--highlight-bg);
-    border-left: 3px solid var(--highlight-border);
-}
-
-.highlight em {
-    font-style: normal;
-    font-weight: bold;
-    background-color: rgba(255, 193, 7, 0.3);
-    padding: 0.1rem 0.2rem;
-    border-radius: 2px;
-}
-
-.card-title {
-    color: var(--primary-color);
-}
-
-.card-subtitle {
-    color: var(--muted-text) !important;
-}
-
-.search-tips code {
-    background-color: var(--code-bg);
-    padding: 0.2rem 0.4rem;
-    border-radius: 4px;
-    color: var(--text-color);
-}
-
-.card {
-    background-color: var(--card-bg);
-    border-color: var(--card-border);
-}
-
-.text-muted {
-    color: var(--muted-text) !important;
-}
+        # Walk the tree once, keeping each non-empty file's size for the indexing pass
+        files = []
+        for entry in _iter_files(directory_path):
+            if entry.name.lower().endswith(_BINARY_EXTENSIONS):
+                continue
+            try:
+                file_size = entry.stat().st_size
+            except OSError:
+                continue
+            if file_size > 0:
+                files.append((entry.path, entry.name, file_size))
+
+        # Files an earlier run finished indexing but stopped before recording. A file
+        # with only some chunks in the index is done again; chunks already there come
+        # back as 409s. So is one whose chunks were partly deduplicated under other paths.
+        if self.es.count(index=self.index_name)['count'] > 0:
+            pending = [f for f in files if f[0] not in indexed_files]
+            indexed_files.update(self._indexed_filepaths(pending))
+
+        # Only the files left to do count towards progress
+        total_found = len(files)
+        files = [f for f in files if f[0] not in indexed_files]
+        if total_found > len(files):
+            print(f"Skipping {total_found - len(files)} already indexed files")
 
-.footer {
-    border-top: 1px solid var(--card-border);
-}
-.footer a:hover {
-    color: var(--primary-color) !important;
-    text-decoration: none;
-}
-""")
-
-# Update the HTML template with dark mode toggle
-with open('templates/index.html', 'w') as f:
-    f.write("""
-<!DOCTYPE html>
-<html data-theme="dark">
-<head>
-    <title>sooox' breach browser</title>
-    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css" rel="stylesheet">
-    <link href="{{ url_for('static', filename='style.css') }}" rel="stylesheet">
-    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.7.2/font/bootstrap-icons.css">
-</head>
-<body>
-    <div class="container">
-        <div id="indexing-status" class="alert alert-info mt-3" style="display: none;">
-            <h5><i class="bi bi-arrow-clockwise"></i> Indexing in progress</h5>
-            <div class="mt-2">
-                <div class="progress mb-2">
-                    <div class="progress-bar progress-bar-striped progress-bar-animated" role="progressbar" style="width: 0%"></div>
-                </div>
-                <small>
-                    Files: <span id="files-progress">0/0</span> | 
-                    Size: <span id="size-progress">0 B/0 B</span> | 
-                    Time: <span id="elapsed-time">0s</span>
-                </small>
-            </div>
-        </div>
-        <div class="row mt-5">
-            <div class="col">
-                <h1 class="text-center mb-4">sooox's breach browser</h1>
-                <div class="search-box">
-                    <input type="text" id="searchInput" class="form-control form-control-lg" 
-                           placeholder="Enter your search query...">
-                    <div class="mt-2 d-flex justify-content-between align-items-center">
-                        <div>
-                            <button onclick="search()" class="btn btn-primary">
-                                <i class="bi bi-search"></i> Search
-                            </button>
-                            <select id="size" class="form-select d-inline-block w-auto ms-2">
-                                <option value="10">10 results</option>
-                                <option value="25">25 results</option>
-                                <option value="50">50 results</option>
-                                <option value="100">100 results</option>
-                            </select>
-                        </div>
-                        <div class="search-tips">
-                            <button class="btn btn-link" type="button" data-bs-toggle="collapse" 
-                                    data-bs-target="#searchTips">
-                                Search Tips
-                            </button>
-                        </div>
-                    </div>
-                </div>
+        with indexing_status.progress_lock:
+            indexing_status.total_files = len(files)
+            indexing_status.total_size = sum(file_size for _, _, file_size in files)
+            indexing_status.start_time = time.time()
+        
+        file_workers = os.cpu_count() or 1
+        # Documents wait here between the file workers and the bulk helper; the bound
+        # keeps memory to a few chunks per worker however far ahead reading gets
+        documents = queue.Queue(maxsize=file_workers * 4)
+        done = object()
+        stop = threading.Event()
+        seen_lock = threading.Lock()
+        progress_file_lock = threading.Lock()
+        # Chunks sent but not yet acknowledged, per file, and the files each chunk id
+        # was sent for. Results carry only the id, and identical chunks share one.
+        pending_chunks = {}
+        chunk_files = {}
+        failed_files = set()
+
+        def process_file(filepath, file, file_size):
+            if stop.is_set():
+                return
+            try:
+                # Workers update these concurrently; += is not atomic
+                with indexing_status.progress_lock:
+                    indexing_status.files_indexed += 1
+                    indexing_status.current_size += file_size
+                    indexing_status.current_file = filepath
                 
-                <div class="collapse mt-3" id="searchTips">
-                    <div class="card card-body">
-                        <h5>Search Tips:</h5>
-                        <ul>
-                            <li><code>term1 AND term2</code> - Find documents containing both terms</li>
-                            <li><code>"exact phrase"</code> - Find exact phrase matches</li>
-                            <li><code>test*</code> - Find words starting with "test"</li>
-                            <li><code>term~</code> - Find similar terms (fuzzy search)</li>
-                            <li><code>term1 OR term2</code> - Find documents with either term</li>
-                            <li><code>NOT term</code> - Exclude documents with this term</li>
-                        </ul>
-                    </div>
-                </div>
+                log.info(f"Processing: {filepath} ({self.format_size(file_size)})")
+                # Only large files are worth interrupting the progress bar for
+                if file_size > LARGE_FILE_SIZE:
+                    tqdm.write(f"Processing: {filepath} ({self.format_size(file_size)})")
                 
-                <div id="stats" class="mt-3 text-muted"></div>
+                with _file_content(filepath, file_size) as (file_hash, data):
+                    if file_hash is None:
+                        log.info(f"Skipping binary file: {filepath}")
+                        return
+                    
+                    with seen_lock:
+                        if file_hash in self._seen_hashes:
+                            log.info(f"Skipping duplicate file: {filepath}")
+                            return
+                        self._seen_hashes.add(file_hash)
+                    
+                    # Find the chunk offsets once; the count goes in every document and
+                    # the same offsets drive the split, so the file is scanned only once
+                    bounds = list(self.chunk_bounds(data))
+                    total_chunks = len(bounds)
+                    log.info(f"Split {filepath} into {total_chunks} chunks")
+                    with progress_file_lock:
+                        pending_chunks[filepath] = total_chunks
+                    # Fields shared by every chunk of this file, merged into each document
+                    file_fields = {
+                        "filename": file,
+                        "filepath": filepath,
+                        "file_hash": file_hash,
+                        "total_chunks": total_chunks,
+                        "file_size": file_size,
+                        "indexed_date": time.strftime('%Y-%m-%dT%H:%M:%S')
+                    }
+                    
+                    # Chunks are created under their content hash, so a chunk that is
+                    # already in the index is rejected as a conflict instead of duplicated
+                    for chunk_num, (chunk_id, chunk) in enumerate(self.chunk_text(data, bounds=bounds)):
+                        if stop.is_set():
+                            return
+                        with progress_file_lock:
+                            chunk_files.setdefault(chunk_id, deque()).append(filepath)
+                        documents.put({
+                            "_op_type": "create",
+                            "_index": self.index_name,
+                            "_id": chunk_id,
+                            "_source": {**file_fields, "content": chunk, "chunk_number": chunk_num}
+                        })
+                    
+            except Exception as e:
+                log.error(f"Error processing {filepath}: {str(e)}")
+                tqdm.write(f"Error processing {filepath}: {str(e)}")
+
+        def chunk_done(chunk_id, indexed):
+            # Save progress once every chunk of a file is in the index, so a run stopped
+            # with chunks still queued or in flight does not skip the file next time
+            with progress_file_lock:
+                waiting = chunk_files.get(chunk_id)
+                if not waiting:
+                    return
+                filepath = waiting.popleft()
+                if not waiting:
+                    del chunk_files[chunk_id]
+                if not indexed:
+                    failed_files.add(filepath)
                 
-                <div id="results" class="mt-4">
-                    <!-- Results will be inserted here -->
-                </div>
-            </div>
-        </div>
-        <div class="footer mt-5 py-3 text-center text-muted">
-            <small>
-                Made with ❤️ by 
-                <a href="https://sooox.cc/" target="_blank" class="text-muted">sooox</a>
-                 | 
-                <a href="https://github.com/sooox-cc/breach-browser" target="_blank" class="text-muted">
-                    <i class="bi bi-github"> </i>GitHub
-                </a>
-            </small>
-        </div>
-    </div>
-
-    <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js"></script>
-    <script>
-        document.getElementById('searchInput').addEventListener('keypress', function(e) {
-            if (e.key === 'Enter') {
-                search();
-            }
-        });
-
-        function formatFileSize(bytes) {
-            const units = ['B', 'KB', 'MB', 'GB'];
-            let size = bytes;
-            let unitIndex = 0;
-            while (size >= 1024 && unitIndex < units.length - 1) {
-                size /= 1024;
-                unitIndex++;
-            }
-            return `${size.toFixed(2)} ${units[unitIndex]}`;
-        }
-
-        function sanitizeUrl(url) {
-            return url.replace(/<script\b[^<]*(?:(?!<\/script>)<[^<]*)*<\/script>/gi, '')
-                      .replace(/javascript:/gi, '')
-                      .replace(/data:/gi, '');
+                pending_chunks[filepath] -= 1
+                if pending_chunks[filepath] == 0:
+                    del pending_chunks[filepath]
+                    if filepath in failed_files:
+                        log.error(f"Not all chunks of {filepath} were indexed, it will be retried on the next run")
+                    else:
+                        indexed_files.add(filepath)
+                        progress_log.write(json.dumps(filepath) + '\n')
+
+        def produce():
+            # Reading, hashing and chunking of separate files overlap across workers;
+            # hashlib and file reads release the GIL while they work
+            with ThreadPoolExecutor(max_workers=file_workers) as pool:
+                for item in files:
+                    pool.submit(process_file, *item)
+            documents.put(done)
+
+        def next_documents():
+            # Senders share the document queue; the end marker is put back for the next one
+            while (doc := documents.get()) is not done:
+                yield doc
+            documents.put(done)
+
+        results = queue.Queue()
+        sender_done = object()
+
+        def send_bulks():
+            # streaming_bulk resends documents the cluster rejects with 429, backing off
+            # exponentially from 2s, and takes nothing from the queue while it waits
+            try:
+                for result in helpers.streaming_bulk(
+                    self.es,
+                    next_documents(),
+                    chunk_size=chunk_size,
+                    max_chunk_bytes=max_chunk_bytes,
+                    max_retries=max_retries,
+                    raise_on_error=False,
+                    raise_on_exception=False
+                ):
+                    results.put(result)
+            except Exception as e:
+                results.put(e)
+            finally:
+                results.put(sender_done)
+
+        success, failed, rejected, duplicates = 0, 0, 0, 0
+        if thread_count is None:
+            thread_count = min(os.cpu_count() or 1, 12)
+
+        # Relax refreshes, replication and translog flushes for the bulk load. The
+        # configured values are put back afterwards rather than the current ones, which
+        # are still the bulk-load values if an earlier run was killed part way.
+        restore_settings = {
+            "refresh_interval": _INDEX_SETTINGS["settings"]["index.refresh_interval"],
+            "number_of_replicas": _INDEX_SETTINGS["settings"]["number_of_replicas"],
+            "translog.flush_threshold_size": None
         }
+        self.es.indices.put_settings(index=self.index_name, body={
+            "index": {
+                "refresh_interval": "-1",
+                "number_of_replicas": 0,
+                "translog.flush_threshold_size": "1gb"
+            }
+        })
 
-        let currentFrom = 0;
-        let isSearching = false;
+        # Line buffered, so each finished file reaches the OS as soon as it is recorded
+        progress_log = open(PROGRESS_FILE, 'a', buffering=1)
 
-        function search(append = false) {
-            if (!append) {
-                currentFrom = 0;
-                document.getElementById('results').innerHTML = '';
-            }
-            
-            if (isSearching) return;
-            isSearching = true;
-            
-            const query = document.getElementById('searchInput').value;
-            const size = document.getElementById('size').value;
-            const results = document.getElementById('results');
-            const stats = document.getElementById('stats');
-            
-            if (!append) {
-                stats.innerHTML = 'Searching...';
-            }
+        # Flow control comes from the bounded document queue: file workers block on it
+        # while every sender is busy with a request or backing off after a 429.
+        # Bulks are cut at whichever limit is hit first; chunk_size is set high so that
+        # max_chunk_bytes decides, keeping request bodies near 40MB whether a batch
+        # holds full chunks or the small tail chunks of many files.
+        producer = threading.Thread(target=produce, daemon=True)
+        senders = [threading.Thread(target=send_bulks, daemon=True) for _ in range(thread_count)]
+        try:
+            producer.start()
+            for sender in senders:
+                sender.start()
             
-            fetch('/search', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    query: query,
-                    size: size,
-                    from: currentFrom
-                })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.error) throw new Error(data.error);
-
-                if (!append) {
-                    results.innerHTML = '';
-                }
-
-                data.hits.forEach(hit => {
-                    const resultDiv = document.createElement('div');
-                    resultDiv.className = 'result-item card mb-3';
-                    let highlights = '';
-                    if (hit.highlights) {
-                        highlights = hit.highlights.map(h => {
-                            const sanitizedHighlight = sanitizeUrl(h);
-                            return `<div class="highlight">${sanitizedHighlight}</div>`;
-                        }).join('');
-                    }
-                    
-                    resultDiv.innerHTML = `
-                        <div class="card-body">
-                            <h5 class="card-title">
-                                <i class="bi bi-file-text"></i> 
-                                ${hit.filename}
-                            </h5>
-                            <h6 class="card-subtitle mb-2">
-                                <i class="bi bi-folder"></i> ${hit.filepath}<br>
-                                <i class="bi bi-layers"></i> Chunk ${hit.chunk_number + 1} of ${hit.total_chunks} | 
-                                <i class="bi bi-file-binary"></i> ${formatFileSize(hit.file_size)} |
-                                <i class="bi bi-star"></i> Score: ${hit.score}
-                            </h6>
-                            <div class="highlights mt-2">
-                                ${highlights}
-                            </div>
-                        </div>
-                    `;
+            with tqdm(desc="Indexing", unit="doc") as pbar:
+                running = len(senders)
+                while running:
+                    result = results.get()
+                    if result is sender_done:
+                        running -= 1
+                        continue
+                    if isinstance(result, Exception):
+                        raise result
                     
-                    results.appendChild(resultDiv);
-                });
-
-                stats.innerHTML = `Found ${data.total} results in ${data.time}ms`;
-                currentFrom += parseInt(size);
-                isSearching = false;
-                
-                if (data.has_more) {
-                    setTimeout(() => search(true), 100);
-                }
-            })
-            .catch(error => {
-                if (!append) {
-                    results.innerHTML = '<div class="alert alert-danger">An error occurred while searching</div>';
-                }
-                isSearching = false;
-                console.error('Error:', error);
-            });
-        }
+                    ok, item = result
+                    info = next(iter(item.values()))
+                    status = info.get('status')
+                    chunk_done(info.get('_id'), ok or status == 409)
+                    success += ok
+                    if not ok:
+                        if status == 409:
+                            # Identical chunk already indexed
+                            duplicates += 1
+                        else:
+                            failed += 1
+                            # 429 here means the cluster was still overloaded after every retry
+                            if status == 429:
+                                rejected += 1
+                    pbar.update(1)
+
+            # Merge the segments left by the bulk load while there are no replicas yet,
+            # so replicas are built from the merged segments instead of merging themselves
+            print("Optimizing index...")
+            self.es.indices.forcemerge(index=self.index_name, max_num_segments=5, request_timeout=3600)
+        except Exception as e:
+            print(f"\nError during indexing: {str(e)}")
+            raise
+        finally:
+            stop.set()
+            # Unblock workers stuck on a full queue so they can see the stop flag
+            while producer.is_alive():
+                try:
+                    documents.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            # The producer's end marker may have been drained; hand one to any sender
+            # still waiting for documents
+            while any(sender.is_alive() for sender in senders):
+                try:
+                    documents.put(done, timeout=0.1)
+                except queue.Full:
+                    pass
+            progress_log.close()
+            self.es.indices.put_settings(index=self.index_name, body={"index": restore_settings})
 
-        function checkIndexingStatus() {
-            fetch('/indexing-status')
-                .then(response => response.json())
-                .then(status => {
-                    const statusDiv = document.getElementById('indexing-status');
-                    if (status.is_indexing) {
-                        statusDiv.style.display = 'block';
-                    } else {
-                        statusDiv.style.display = 'none';
-                    }
-                });
-        }
+        # Make everything searchable now rather than at the next refresh_interval
+        self.es.indices.refresh(index=self.index_name)
 
-        function updateIndexingStatus() {
-            fetch('/indexing-status')
-                .then(response => response.json())
-                .then(status => {
-                    const statusDiv = document.getElementById('indexing-status');
-                    if (status.is_indexing) {
-                        statusDiv.style.display = 'block';
-                        document.querySelector('#indexing-status .progress-bar').style.width = `${status.percent_complete}%`;
-                        document.getElementById('files-progress').textContent = `${status.files_indexed}/${status.total_files}`;
-                        document.getElementById('size-progress').textContent = `${status.processed_size}/${status.total_size}`;
-                        document.getElementById('elapsed-time').textContent = status.elapsed_time;
-                    } else {
-                        statusDiv.style.display = 'none';
-                    }
-                });
-        }
+        print(f"\nIndexing complete. Success: {success}, Failed: {failed}, Duplicates: {duplicates}")
+        if rejected:
+            print(f"{rejected} documents were rejected by an overloaded cluster after "
+                  f"{max_retries} retries, consider a lower thread_count")
 
-        // Remove the old checkIndexingStatus function since updateIndexingStatus replaces it
-        // Only need one interval
-        setInterval(updateIndexingStatus, 1000);
-    </script>
-</body>
-</html>
-""")
+    def get_index_stats(self):
+        """Get statistics about the current index, cached for STATS_CACHE_TTL seconds"""
+        if self._stats_cache and time.time() - self._stats_cache[0] < STATS_CACHE_TTL:
+            return self._stats_cache[1]
+        
+        try:
+            # Store size and document count in one call, shard settings in another
+            basic_stats = self.es.indices.stats(index=self.index_name, metric='store,docs')
+            index_settings = self.es.indices.get_settings(index=self.index_name)
+        except NotFoundError:
+            stats = {"exists": False}
+        except Exception as e:
+            print(f"Error getting stats: {str(e)}")
+            return {"exists": False, "error": str(e)}
+        else:
+            primaries = basic_stats['indices'][self.index_name]['primaries']
+            size_in_bytes = primaries['store']['size_in_bytes']
+            settings = index_settings[self.index_name]['settings']['index']
+            stats = {
+                "exists": True,
+                "total_documents": primaries['docs']['count'],
+                "size_in_bytes": size_in_bytes,
+                "store_size": self.format_size(size_in_bytes),
+                "number_of_shards": settings['number_of_shards'],
+                "number_of_replicas": settings['number_of_replicas']
+            }
+        
+        self._stats_cache = (time.time(), stats)
+        return stats
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+# Everything in a search request except the query and paging, built once at import
+_SEARCH_TEMPLATE = {
+    "highlight": {
+        "fields": {
+            "content": {
+                "type": "unified",
+                "fragment_size": 150,
+                "number_of_fragments": 3,
+                "pre_tags": ["<em>"],
+                "post_tags": ["</em>"],
+                "boundary_scanner": "sentence",
+                "boundary_scanner_locale": "en-US",
+                "fragment_offset": 0,
+                "no_match_size": 0
+            }
+        },
+        "boundary_max_scan": 50
+    },
+    "_source": ["filename", "filepath", "chunk_number", "total_chunks", "file_size"]
+}
+
+def _matched_lines(fragments):
+    """Reduce highlight fragments to the stripped lines that contain a match"""
+    lines = []
+    for fragment in fragments:
+        # The sentence scanner already breaks on newlines, so most fragments are
+        # a single line and only the ones spanning several need splitting
+        if '\n' not in fragment:
+            lines.append(fragment.strip())
+        else:
+            lines.extend(line.strip() for line in fragment.split('\n') if '<em>' in line)
+    return lines
+
 @app.route('/search', methods=['POST'])
 def search():
     data = request.get_json()
@@ -650,60 +746,29 @@ def search():
     size = int(data.get('size', 10))
     from_pos = int(data.get('from', 0))
     
-    search_query = {
-        "query": {
-            "query_string": {
-                "query": query,
-                "fields": ["content"],
-                "default_operator": "AND"
-            }
-        },
-        "highlight": {
-            "fields": {
-                "content": {
-                    "fragment_size": 150,
-                    "number_of_fragments": 3,
-                    "pre_tags": ["<em>"],
-                    "post_tags": ["</em>"],
-                    "boundary_scanner": "sentence",
-                    "boundary_scanner_locale": "en-US",
-                    "fragment_offset": 0,
-                    "no_match_size": 0
-                }
-            },
-            "boundary_max_scan": 50
-        },
-        "_source": ["filename", "filepath", "chunk_number", "total_chunks", "file_size"],
-        "from": from_pos,
-        "size": size
+    # Shallow copy: only the top-level keys below change per request
+    search_query = _SEARCH_TEMPLATE.copy()
+    search_query["query"] = {
+        "query_string": {
+            "query": query,
+            "fields": ["content"],
+            "default_operator": "AND"
+        }
     }
+    search_query["from"] = from_pos
+    search_query["size"] = size
     
     try:
         start_time = time.time()
-        response = es.search(index="text_documents", body=search_query)
+        response = engine.es.search(index=engine.index_name, body=search_query)
         search_time = int((time.time() - start_time) * 1000)
         
-        hits = []
-        for hit in response['hits']['hits']:
-            highlights = hit.get('highlight', {}).get('content', [])
-            cleaned_highlights = []
-            
-            for highlight in highlights:
-                lines = highlight.split('\n')
-                relevant_lines = [line.strip() for line in lines if '<em>' in line]
-                if relevant_lines:
-                    cleaned_highlights.extend(relevant_lines)
-            
-            result = {
-                'filename': hit['_source']['filename'],
-                'filepath': hit['_source']['filepath'],
-                'chunk_number': hit['_source']['chunk_number'],
-                'total_chunks': hit['_source']['total_chunks'],
-                'file_size': hit['_source']['file_size'],
-                'score': round(hit['_score'], 2),
-                'highlights': cleaned_highlights
-            }
-            hits.append(result)
+        # _source is already limited to the fields the UI shows
+        hits = [{
+            **hit['_source'],
+            'score': round(hit['_score'], 2),
+            'highlights': _matched_lines(hit.get('highlight', {}).get('content', []))
+        } for hit in response['hits']['hits']]
         
         total_hits = response['hits']['total']['value']
         return jsonify({
@@ -719,12 +784,6 @@ def search():
 
 if __name__ == '__main__':
     print("Initializing search engine...")
-    es = Elasticsearch(
-        ['http://localhost:9200'],
-        timeout=60,
-        max_retries=3,
-        retry_on_timeout=True
-    )
     engine = TextSearchEngine()
     
     # Get and display current index statistics
@@ -754,7 +813,8 @@ if __name__ == '__main__':
             print("Deleting existing index...")
             engine.delete_index()
             print("Creating new index...")
-            engine.create_index()
+            # Size the new index's shards from what the previous index held
+            engine.create_index(target_size=stats.get("size_in_bytes", 0))
             print(f"Starting background indexing of: {data_dir}")
             start_indexing(engine, data_dir)
             print("Indexing started in background. Web interface available while indexing continues.")